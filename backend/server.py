@@ -5,7 +5,8 @@ from fastapi.middleware.trustedhost import TrustedHostMiddleware
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.middleware.gzip import GZipMiddleware
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from fastapi.responses import JSONResponse
+from fastapi.responses import ORJSONResponse
+from fastapi.concurrency import run_in_threadpool
 from fastapi.exceptions import RequestValidationError
 from fastapi.exception_handlers import request_validation_exception_handler
 from dotenv import load_dotenv
@@ -17,15 +18,22 @@ import jwt
 from typing import Optional, List, Dict, Any
 import bcrypt
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
 from bson import ObjectId
 from bson.errors import InvalidId
 import asyncio
 import requests
-import json
+import orjson
+import re
 from pydantic import BaseModel, Field, field_validator, model_validator, EmailStr, ConfigDict
 from pydantic.types import constr
 from contextlib import asynccontextmanager
 import socket
+import time
+from collections import defaultdict, OrderedDict
+import hashlib
+import uvicorn
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
@@ -41,6 +49,37 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+class TTLCache:
+    def __init__(self, name, ttl_seconds, max_entries):
+        self.name = name
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.generation = 0
+
+    async def get_or_load(self, key, loader):
+        cached = self.entries.get(key)
+        if cached and cached[0] > time.monotonic():
+            self.entries.move_to_end(key)
+            return cached[1]
+        logger.debug("%s cache miss for %s", self.name, key)
+        generation = self.generation
+        value = await loader()
+        if generation != self.generation:
+            return value
+        self.entries[key] = (time.monotonic() + self.ttl_seconds, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        return value
+
+    def invalidate(self, key=None):
+        self.generation += 1
+        if key is None:
+            self.entries.clear()
+        else:
+            self.entries.pop(key, None)
+
 mongo_url = os.environ.get('MONGO_URL', 'mongodb://localhost:27017')
 client = AsyncIOMotorClient(
     mongo_url,
@@ -51,14 +90,50 @@ client = AsyncIOMotorClient(
 )
 db = client[os.environ.get('DB_NAME', 'flexisched_db')]
 
+http_session = requests.Session()
+
 security = HTTPBearer()
 
 JWT_SECRET = os.environ.get('JWT_SECRET', 'flexisched-jwt-secret-key-2025-change-in-production')
 JWT_ALGORITHM = 'HS256'
 JWT_EXPIRATION_HOURS = 24
+JWT_EXPIRATION = timedelta(hours=JWT_EXPIRATION_HOURS)
 
 OPENROUTER_API_KEY = os.environ.get('OPENROUTER_API_KEY')
 OPENROUTER_MODEL = os.environ.get('OPENROUTER_MODEL', 'nvidia/nemotron-nano-12b-v2-vl:free')
+OPENROUTER_TIMEOUT_SECONDS = float(os.environ.get('OPENROUTER_TIMEOUT_SECONDS', '300'))
+
+DEFAULT_WORKING_DAYS = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday']
+VALID_DAYS = frozenset(['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday'])
+DEFAULT_CREDIT_LIMITS = {'minCredits': 15, 'maxCredits': 25}
+DEMO_SEED_KEY = 'demo_seed'
+DEMO_SEED_STALE_SECONDS = 600
+LAB_ROOM_TYPES = frozenset({'lab'})
+THEORY_ROOM_TYPES = frozenset({'classroom', 'auditorium'})
+
+SETTINGS_CACHE_TTL_SECONDS = float(os.environ.get('SETTINGS_CACHE_TTL_SECONDS', '60'))
+SETTINGS_CACHE_MAX_ENTRIES = 32
+settings_cache = TTLCache('settings', SETTINGS_CACHE_TTL_SECONDS, SETTINGS_CACHE_MAX_ENTRIES)
+
+COURSE_LIST_CACHE_TTL_SECONDS = 60
+COURSE_LIST_CACHE_MAX_PAGES = 64
+course_list_cache = TTLCache('course list', COURSE_LIST_CACHE_TTL_SECONDS, COURSE_LIST_CACHE_MAX_PAGES)
+
+SCHEDULE_USAGE_CACHE_TTL_SECONDS = float(os.environ.get('SCHEDULE_USAGE_CACHE_TTL_SECONDS', '30'))
+SCHEDULE_USAGE_CACHE_MAX_ENTRIES = 256
+schedule_usage_cache = TTLCache('schedule usage', SCHEDULE_USAGE_CACHE_TTL_SECONDS, SCHEDULE_USAGE_CACHE_MAX_ENTRIES)
+
+AI_CACHE_MAX_ENTRIES = int(os.environ.get('AI_CACHE_MAX_ENTRIES', '128'))
+AI_CACHE_TTL_SECONDS = float(os.environ.get('AI_CACHE_TTL_SECONDS', '3600'))
+ai_response_cache = OrderedDict()
+ai_cache_lock = asyncio.Lock()
+ai_inflight_requests = {}
+REFRESH_QUERY_DESCRIPTION = (
+    'Bypass the cached AI response and request a new timetable. Without it, an identical '
+    'request within AI_CACHE_TTL_SECONDS returns the timetable already stored for that request.'
+)
+
+CODE_FENCE_PATTERN = re.compile(r'^\s*```(?:json)?|```\s*$', re.IGNORECASE)
 
 class RegisterRequest(BaseModel):
     email: EmailStr
@@ -133,7 +208,7 @@ class BaseTimetableRequest(BaseModel):
     classDuration: float = 1.0
     lunchBreakDuration: float = 1.0
     lunchBreakPosition: str = 'middle'
-    days: List[str] = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday']
+    days: List[str] = DEFAULT_WORKING_DAYS
     includeShortBreaks: bool = True
 
 class AvailableSlot(BaseModel):
@@ -148,6 +223,30 @@ class FacultyProfileRequest(BaseModel):
     availableSlots: Optional[List[AvailableSlot]] = None
     minTeachingHours: Optional[int] = Field(None, ge=1)
 
+class FacultyCoursesRequest(BaseModel):
+    courseIds: List[str] = []
+
+class TimetablePreference(BaseModel):
+    course_id: str
+    day: str
+    start_time: str
+    end_time: str = ''
+
+class TimetablePreferencesRequest(BaseModel):
+    preferences: List[TimetablePreference] = []
+
+class CourseRegistration(BaseModel):
+    course_id: str
+    preferred_time: str = ''
+    preferred_professor: str = ''
+    priority: int = 1
+
+class RegisterCoursesRequest(BaseModel):
+    courses: List[CourseRegistration] = []
+
+class StudentTimetableRequest(BaseModel):
+    courseIds: List[str] = []
+
 class StudentProfileRequest(BaseModel):
     name: Optional[str] = Field(None, min_length=2)
     email: Optional[EmailStr] = None
@@ -168,24 +267,49 @@ async def create_indexes():
         await db.base_timetables.create_index("created_at")
         await db.timetables.create_index("generated_at")
         await db.timetables.create_index("generated_by")
+        await db.timetables.create_index("prompt_hash")
         await db.settings.create_index("key", unique=True)
         await db.faculty_preferences.create_index([("faculty_id", 1)])
         await db.student_course_preferences.create_index([("student_id", 1)])
         logger.info("Database indexes created successfully")
     except Exception as e:
-        logger.error(f"Error creating indexes: {str(e)}")
+        logger.error("Error creating indexes: %s", e)
+
+async def claim_demo_seed(claimed_at):
+    claim = {'key': DEMO_SEED_KEY, 'value': {'status': 'in_progress', 'claimed_at': claimed_at.isoformat()}}
+    try:
+        await db.settings.insert_one(claim)
+        return True
+    except DuplicateKeyError:
+        pass
+    stale_before = (claimed_at - timedelta(seconds=DEMO_SEED_STALE_SECONDS)).isoformat()
+    stale_claim = await db.settings.find_one_and_update(
+        {'key': DEMO_SEED_KEY, 'value.status': 'in_progress', 'value.claimed_at': {'$lt': stale_before}},
+        {'$set': {'value': claim['value']}}
+    )
+    if stale_claim is None:
+        return False
+    logger.warning("Taking over stale demo data seeding claimed at %s", stale_claim['value']['claimed_at'])
+    return True
 
 async def initialize_demo_data():
+    seed_claimed = False
     try:
         admin_exists = await db.users.find_one({'email': 'admin@flexisched.com'})
         if not admin_exists:
+            claimed_at = datetime.now(timezone.utc)
+            if not await claim_demo_seed(claimed_at):
+                logger.info("Demo data seeding is in progress or already done (settings key %s); skipping", DEMO_SEED_KEY)
+                return
+            seed_claimed = True
+            seeded_at = claimed_at.isoformat()
             logger.info("Admin user not found. Creating extensive demo data.")
             await db.users.delete_many({})
             await db.courses.delete_many({})
             await db.rooms.delete_many({})
             await db.base_timetables.delete_many({})
             await db.timetables.delete_many({})
-            await db.settings.delete_many({})
+            await db.settings.delete_many({'key': {'$ne': DEMO_SEED_KEY}})
             await db.faculty_preferences.delete_many({})
             await db.student_course_preferences.delete_many({})
             
@@ -194,70 +318,71 @@ async def initialize_demo_data():
                 'password_hash': hash_password('admin123'),
                 'name': 'Admin User',
                 'role': 'admin',
-                'created_at': datetime.now(timezone.utc).isoformat()
+                'created_at': seeded_at
             }
             await db.users.insert_one(admin)
             
+            faculty_password_hash = hash_password('faculty123')
+            student_password_hash = hash_password('student123')
+            
             faculty_data = [
-                {'email': 'dr.smith@univ.edu', 'name': 'Dr. John Smith', 'password_hash': hash_password('faculty123'), 'role': 'faculty', 'department': 'Computer Science'},
-                {'email': 'dr.patel@univ.edu', 'name': 'Dr. Priya Patel', 'password_hash': hash_password('faculty123'), 'role': 'faculty', 'department': 'Computer Science'},
-                {'email': 'dr.kumar@univ.edu', 'name': 'Dr. Raj Kumar', 'password_hash': hash_password('faculty123'), 'role': 'faculty', 'department': 'Mathematics'},
-                {'email': 'dr.wong@univ.edu', 'name': 'Dr. Lisa Wong', 'password_hash': hash_password('faculty123'), 'role': 'faculty', 'department': 'Physics'},
-                {'email': 'dr.johnson@univ.edu', 'name': 'Dr. Michael Johnson', 'password_hash': hash_password('faculty123'), 'role': 'faculty', 'department': 'Chemistry'},
-                {'email': 'dr.williams@univ.edu', 'name': 'Dr. Sarah Williams', 'password_hash': hash_password('faculty123'), 'role': 'faculty', 'department': 'Biology'},
-                {'email': 'dr.brown@univ.edu', 'name': 'Dr. James Brown', 'password_hash': hash_password('faculty123'), 'role': 'faculty', 'department': 'English'},
-                {'email': 'dr.davis@univ.edu', 'name': 'Dr. Emily Davis', 'password_hash': hash_password('faculty123'), 'role': 'faculty', 'department': 'Economics'},
-                {'email': 'dr.miller@univ.edu', 'name': 'Dr. Robert Miller', 'password_hash': hash_password('faculty123'), 'role': 'faculty', 'department': 'History'},
-                {'email': 'dr.wilson@univ.edu', 'name': 'Dr. Jennifer Wilson', 'password_hash': hash_password('faculty123'), 'role': 'faculty', 'department': 'Psychology'},
+                {'email': 'dr.smith@univ.edu', 'name': 'Dr. John Smith', 'password_hash': faculty_password_hash, 'role': 'faculty', 'department': 'Computer Science'},
+                {'email': 'dr.patel@univ.edu', 'name': 'Dr. Priya Patel', 'password_hash': faculty_password_hash, 'role': 'faculty', 'department': 'Computer Science'},
+                {'email': 'dr.kumar@univ.edu', 'name': 'Dr. Raj Kumar', 'password_hash': faculty_password_hash, 'role': 'faculty', 'department': 'Mathematics'},
+                {'email': 'dr.wong@univ.edu', 'name': 'Dr. Lisa Wong', 'password_hash': faculty_password_hash, 'role': 'faculty', 'department': 'Physics'},
+                {'email': 'dr.johnson@univ.edu', 'name': 'Dr. Michael Johnson', 'password_hash': faculty_password_hash, 'role': 'faculty', 'department': 'Chemistry'},
+                {'email': 'dr.williams@univ.edu', 'name': 'Dr. Sarah Williams', 'password_hash': faculty_password_hash, 'role': 'faculty', 'department': 'Biology'},
+                {'email': 'dr.brown@univ.edu', 'name': 'Dr. James Brown', 'password_hash': faculty_password_hash, 'role': 'faculty', 'department': 'English'},
+                {'email': 'dr.davis@univ.edu', 'name': 'Dr. Emily Davis', 'password_hash': faculty_password_hash, 'role': 'faculty', 'department': 'Economics'},
+                {'email': 'dr.miller@univ.edu', 'name': 'Dr. Robert Miller', 'password_hash': faculty_password_hash, 'role': 'faculty', 'department': 'History'},
+                {'email': 'dr.wilson@univ.edu', 'name': 'Dr. Jennifer Wilson', 'password_hash': faculty_password_hash, 'role': 'faculty', 'department': 'Psychology'},
             ]
             
-            faculty_ids = []
             for fac in faculty_data:
-                fac['created_at'] = datetime.now(timezone.utc).isoformat()
-                result = await db.users.insert_one(fac)
-                faculty_ids.append(str(result.inserted_id))
+                fac['created_at'] = seeded_at
+            result = await db.users.insert_many(faculty_data)
+            faculty_ids = [str(inserted_id) for inserted_id in result.inserted_ids]
             
             student_data = [
-                {'email': 'alice.johnson@univ.edu', 'name': 'Alice Johnson', 'password_hash': hash_password('student123'), 'role': 'student', 'enrollment_year': '2023'},
-                {'email': 'bob.williams@univ.edu', 'name': 'Bob Williams', 'password_hash': hash_password('student123'), 'role': 'student', 'enrollment_year': '2023'},
-                {'email': 'carol.davis@univ.edu', 'name': 'Carol Davis', 'password_hash': hash_password('student123'), 'role': 'student', 'enrollment_year': '2023'},
-                {'email': 'david.miller@univ.edu', 'name': 'David Miller', 'password_hash': hash_password('student123'), 'role': 'student', 'enrollment_year': '2022'},
-                {'email': 'emma.wilson@univ.edu', 'name': 'Emma Wilson', 'password_hash': hash_password('student123'), 'role': 'student', 'enrollment_year': '2022'},
-                {'email': 'frank.moore@univ.edu', 'name': 'Frank Moore', 'password_hash': hash_password('student123'), 'role': 'student', 'enrollment_year': '2024'},
-                {'email': 'grace.taylor@univ.edu', 'name': 'Grace Taylor', 'password_hash': hash_password('student123'), 'role': 'student', 'enrollment_year': '2024'},
-                {'email': 'henry.anderson@univ.edu', 'name': 'Henry Anderson', 'password_hash': hash_password('student123'), 'role': 'student', 'enrollment_year': '2021'},
-                {'email': 'isabella.thomas@univ.edu', 'name': 'Isabella Thomas', 'password_hash': hash_password('student123'), 'role': 'student', 'enrollment_year': '2021'},
-                {'email': 'jack.jackson@univ.edu', 'name': 'Jack Jackson', 'password_hash': hash_password('student123'), 'role': 'student', 'enrollment_year': '2023'},
-                {'email': 'kate.white@univ.edu', 'name': 'Kate White', 'password_hash': hash_password('student123'), 'role': 'student', 'enrollment_year': '2024'},
-                {'email': 'liam.harris@univ.edu', 'name': 'Liam Harris', 'password_hash': hash_password('student123'), 'role': 'student', 'enrollment_year': '2022'},
-                {'email': 'mia.martin@univ.edu', 'name': 'Mia Martin', 'password_hash': hash_password('student123'), 'role': 'student', 'enrollment_year': '2022'},
-                {'email': 'noah.thompson@univ.edu', 'name': 'Noah Thompson', 'password_hash': hash_password('student123'), 'role': 'student', 'enrollment_year': '2023'},
-                {'email': 'olivia.garcia@univ.edu', 'name': 'Olivia Garcia', 'password_hash': hash_password('student123'), 'role': 'student', 'enrollment_year': '2024'},
-                {'email': 'peter.martinez@univ.edu', 'name': 'Peter Martinez', 'password_hash': hash_password('student123'), 'role': 'student', 'enrollment_year': '2021'},
-                {'email': 'quinn.robinson@univ.edu', 'name': 'Quinn Robinson', 'password_hash': hash_password('student123'), 'role': 'student', 'enrollment_year': '2021'},
-                {'email': 'rachel.clark@univ.edu', 'name': 'Rachel Clark', 'password_hash': hash_password('student123'), 'role': 'student', 'enrollment_year': '2024'},
-                {'email': 'samuel.rodriguez@univ.edu', 'name': 'Samuel Rodriguez', 'password_hash': hash_password('student123'), 'role': 'student', 'enrollment_year': '2023'},
-                {'email': 'taylor.lewis@univ.edu', 'name': 'Taylor Lewis', 'password_hash': hash_password('student123'), 'role': 'student', 'enrollment_year': '2022'},
-                {'email': 'ursula.lee@univ.edu', 'name': 'Ursula Lee', 'password_hash': hash_password('student123'), 'role': 'student', 'enrollment_year': '2024'},
-                {'email': 'victor.walker@univ.edu', 'name': 'Victor Walker', 'password_hash': hash_password('student123'), 'role': 'student', 'enrollment_year': '2021'},
-                {'email': 'wendy.hall@univ.edu', 'name': 'Wendy Hall', 'password_hash': hash_password('student123'), 'role': 'student', 'enrollment_year': '2023'},
-                {'email': 'xavier.allen@univ.edu', 'name': 'Xavier Allen', 'password_hash': hash_password('student123'), 'role': 'student', 'enrollment_year': '2022'},
-                {'email': 'yasmine.young@univ.edu', 'name': 'Yasmine Young', 'password_hash': hash_password('student123'), 'role': 'student', 'enrollment_year': '2024'},
-                {'email': 'zachary.king@univ.edu', 'name': 'Zachary King', 'password_hash': hash_password('student123'), 'role': 'student', 'enrollment_year': '2021'},
-                {'email': 'amy.scott@univ.edu', 'name': 'Amy Scott', 'password_hash': hash_password('student123'), 'role': 'student', 'enrollment_year': '2023'},
-                {'email': 'brian.green@univ.edu', 'name': 'Brian Green', 'password_hash': hash_password('student123'), 'role': 'student', 'enrollment_year': '2024'},
-                {'email': 'chloe.adams@univ.edu', 'name': 'Chloe Adams', 'password_hash': hash_password('student123'), 'role': 'student', 'enrollment_year': '2022'},
-                {'email': 'daniel.baker@univ.edu', 'name': 'Daniel Baker', 'password_hash': hash_password('student123'), 'role': 'student', 'enrollment_year': '2023'},
-                {'email': 'eva.nelson@univ.edu', 'name': 'Eva Nelson', 'password_hash': hash_password('student123'), 'role': 'student', 'enrollment_year': '2024'},
-                {'email': 'felix.carter@univ.edu', 'name': 'Felix Carter', 'password_hash': hash_password('student123'), 'role': 'student', 'enrollment_year': '2021'},
-                {'email': 'georgia.mitchell@univ.edu', 'name': 'Georgia Mitchell', 'password_hash': hash_password('student123'), 'role': 'student', 'enrollment_year': '2022'},
+                {'email': 'alice.johnson@univ.edu', 'name': 'Alice Johnson', 'password_hash': student_password_hash, 'role': 'student', 'enrollment_year': '2023'},
+                {'email': 'bob.williams@univ.edu', 'name': 'Bob Williams', 'password_hash': student_password_hash, 'role': 'student', 'enrollment_year': '2023'},
+                {'email': 'carol.davis@univ.edu', 'name': 'Carol Davis', 'password_hash': student_password_hash, 'role': 'student', 'enrollment_year': '2023'},
+                {'email': 'david.miller@univ.edu', 'name': 'David Miller', 'password_hash': student_password_hash, 'role': 'student', 'enrollment_year': '2022'},
+                {'email': 'emma.wilson@univ.edu', 'name': 'Emma Wilson', 'password_hash': student_password_hash, 'role': 'student', 'enrollment_year': '2022'},
+                {'email': 'frank.moore@univ.edu', 'name': 'Frank Moore', 'password_hash': student_password_hash, 'role': 'student', 'enrollment_year': '2024'},
+                {'email': 'grace.taylor@univ.edu', 'name': 'Grace Taylor', 'password_hash': student_password_hash, 'role': 'student', 'enrollment_year': '2024'},
+                {'email': 'henry.anderson@univ.edu', 'name': 'Henry Anderson', 'password_hash': student_password_hash, 'role': 'student', 'enrollment_year': '2021'},
+                {'email': 'isabella.thomas@univ.edu', 'name': 'Isabella Thomas', 'password_hash': student_password_hash, 'role': 'student', 'enrollment_year': '2021'},
+                {'email': 'jack.jackson@univ.edu', 'name': 'Jack Jackson', 'password_hash': student_password_hash, 'role': 'student', 'enrollment_year': '2023'},
+                {'email': 'kate.white@univ.edu', 'name': 'Kate White', 'password_hash': student_password_hash, 'role': 'student', 'enrollment_year': '2024'},
+                {'email': 'liam.harris@univ.edu', 'name': 'Liam Harris', 'password_hash': student_password_hash, 'role': 'student', 'enrollment_year': '2022'},
+                {'email': 'mia.martin@univ.edu', 'name': 'Mia Martin', 'password_hash': student_password_hash, 'role': 'student', 'enrollment_year': '2022'},
+                {'email': 'noah.thompson@univ.edu', 'name': 'Noah Thompson', 'password_hash': student_password_hash, 'role': 'student', 'enrollment_year': '2023'},
+                {'email': 'olivia.garcia@univ.edu', 'name': 'Olivia Garcia', 'password_hash': student_password_hash, 'role': 'student', 'enrollment_year': '2024'},
+                {'email': 'peter.martinez@univ.edu', 'name': 'Peter Martinez', 'password_hash': student_password_hash, 'role': 'student', 'enrollment_year': '2021'},
+                {'email': 'quinn.robinson@univ.edu', 'name': 'Quinn Robinson', 'password_hash': student_password_hash, 'role': 'student', 'enrollment_year': '2021'},
+                {'email': 'rachel.clark@univ.edu', 'name': 'Rachel Clark', 'password_hash': student_password_hash, 'role': 'student', 'enrollment_year': '2024'},
+                {'email': 'samuel.rodriguez@univ.edu', 'name': 'Samuel Rodriguez', 'password_hash': student_password_hash, 'role': 'student', 'enrollment_year': '2023'},
+                {'email': 'taylor.lewis@univ.edu', 'name': 'Taylor Lewis', 'password_hash': student_password_hash, 'role': 'student', 'enrollment_year': '2022'},
+                {'email': 'ursula.lee@univ.edu', 'name': 'Ursula Lee', 'password_hash': student_password_hash, 'role': 'student', 'enrollment_year': '2024'},
+                {'email': 'victor.walker@univ.edu', 'name': 'Victor Walker', 'password_hash': student_password_hash, 'role': 'student', 'enrollment_year': '2021'},
+                {'email': 'wendy.hall@univ.edu', 'name': 'Wendy Hall', 'password_hash': student_password_hash, 'role': 'student', 'enrollment_year': '2023'},
+                {'email': 'xavier.allen@univ.edu', 'name': 'Xavier Allen', 'password_hash': student_password_hash, 'role': 'student', 'enrollment_year': '2022'},
+                {'email': 'yasmine.young@univ.edu', 'name': 'Yasmine Young', 'password_hash': student_password_hash, 'role': 'student', 'enrollment_year': '2024'},
+                {'email': 'zachary.king@univ.edu', 'name': 'Zachary King', 'password_hash': student_password_hash, 'role': 'student', 'enrollment_year': '2021'},
+                {'email': 'amy.scott@univ.edu', 'name': 'Amy Scott', 'password_hash': student_password_hash, 'role': 'student', 'enrollment_year': '2023'},
+                {'email': 'brian.green@univ.edu', 'name': 'Brian Green', 'password_hash': student_password_hash, 'role': 'student', 'enrollment_year': '2024'},
+                {'email': 'chloe.adams@univ.edu', 'name': 'Chloe Adams', 'password_hash': student_password_hash, 'role': 'student', 'enrollment_year': '2022'},
+                {'email': 'daniel.baker@univ.edu', 'name': 'Daniel Baker', 'password_hash': student_password_hash, 'role': 'student', 'enrollment_year': '2023'},
+                {'email': 'eva.nelson@univ.edu', 'name': 'Eva Nelson', 'password_hash': student_password_hash, 'role': 'student', 'enrollment_year': '2024'},
+                {'email': 'felix.carter@univ.edu', 'name': 'Felix Carter', 'password_hash': student_password_hash, 'role': 'student', 'enrollment_year': '2021'},
+                {'email': 'georgia.mitchell@univ.edu', 'name': 'Georgia Mitchell', 'password_hash': student_password_hash, 'role': 'student', 'enrollment_year': '2022'},
             ]
             
-            student_ids = []
             for stu in student_data:
-                stu['created_at'] = datetime.now(timezone.utc).isoformat()
-                result = await db.users.insert_one(stu)
-                student_ids.append(str(result.inserted_id))
+                stu['created_at'] = seeded_at
+            result = await db.users.insert_many(student_data)
+            student_ids = [str(inserted_id) for inserted_id in result.inserted_ids]
             
             rooms = [
                 {'name': 'Room 101', 'capacity': 60, 'type': 'classroom'},
@@ -280,11 +405,10 @@ async def initialize_demo_data():
                 {'name': 'Conference Room 2', 'capacity': 20, 'type': 'classroom'},
             ]
             
-            room_ids = []
             for room in rooms:
-                room['created_at'] = datetime.now(timezone.utc).isoformat()
-                result = await db.rooms.insert_one(room)
-                room_ids.append(str(result.inserted_id))
+                room['created_at'] = seeded_at
+            result = await db.rooms.insert_many(rooms)
+            room_ids = [str(inserted_id) for inserted_id in result.inserted_ids]
             
             courses = [
                 {'name': 'Data Structures', 'code': 'CS201', 'credits': 4, 'category': 'Major', 'duration_hours': 1, 'is_lab': False, 'faculty_id': faculty_ids[0]},
@@ -340,29 +464,26 @@ async def initialize_demo_data():
                 {'name': 'Data Science', 'code': 'DS401', 'credits': 4, 'category': 'Major', 'duration_hours': 1, 'is_lab': False, 'faculty_id': faculty_ids[0]},
             ]
             
-            course_ids = []
             for course in courses:
-                course['created_at'] = datetime.now(timezone.utc).isoformat()
-                result = await db.courses.insert_one(course)
-                course_ids.append(str(result.inserted_id))
+                course['created_at'] = seeded_at
+            result = await db.courses.insert_many(courses)
+            course_ids = [str(inserted_id) for inserted_id in result.inserted_ids]
+            courses_by_id = {str(course['_id']): course for course in courses}
             
             base_timetable = {
                 'startTime': '09:00',
                 'endTime': '17:00',
                 'classDuration': '1',
                 'lunchBreakDuration': '1',
-                'days': ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday'],
-                'created_at': datetime.now(timezone.utc).isoformat()
+                'days': DEFAULT_WORKING_DAYS,
+                'created_at': seeded_at
             }
             await db.base_timetables.insert_one(base_timetable)
             
             credit_limits = {
                 'key': 'credit_limits',
-                'value': {
-                    'minCredits': 15,
-                    'maxCredits': 25
-                },
-                'created_at': datetime.now(timezone.utc).isoformat()
+                'value': DEFAULT_CREDIT_LIMITS,
+                'created_at': seeded_at
             }
             await db.settings.insert_one(credit_limits)
             
@@ -375,7 +496,7 @@ async def initialize_demo_data():
                         {'day': 'Wednesday', 'time': '2:00 PM - 3:00 PM', 'course_id': course_ids[2], 'course_name': 'Algorithms', 'room_id': room_ids[1], 'room_name': 'Room 102'},
                         {'day': 'Friday', 'time': '11:00 AM - 12:00 PM', 'course_id': course_ids[3], 'course_name': 'Database Management Systems', 'room_id': room_ids[2], 'room_name': 'Room 103'},
                     ],
-                    'generated_at': datetime.now(timezone.utc).isoformat(),
+                    'generated_at': seeded_at,
                     'generated_by': faculty_ids[0]
                 },
                 {
@@ -386,7 +507,7 @@ async def initialize_demo_data():
                         {'day': 'Thursday', 'time': '10:00 AM - 11:00 AM', 'course_id': course_ids[7], 'course_name': 'Computer Networks', 'room_id': room_ids[7], 'room_name': 'Room 203'},
                         {'day': 'Thursday', 'time': '3:00 PM - 4:00 PM', 'course_id': course_ids[8], 'course_name': 'Software Engineering', 'room_id': room_ids[4], 'room_name': 'Room 105'},
                     ],
-                    'generated_at': datetime.now(timezone.utc).isoformat(),
+                    'generated_at': seeded_at,
                     'generated_by': faculty_ids[1]
                 },
                 {
@@ -397,7 +518,7 @@ async def initialize_demo_data():
                         {'day': 'Friday', 'time': '2:00 PM - 3:00 PM', 'course_id': course_ids[12], 'course_name': 'Linear Algebra', 'room_id': room_ids[1], 'room_name': 'Room 102'},
                         {'day': 'Tuesday', 'time': '3:00 PM - 4:00 PM', 'course_id': course_ids[14], 'course_name': 'Statistics', 'room_id': room_ids[2], 'room_name': 'Room 103'},
                     ],
-                    'generated_at': datetime.now(timezone.utc).isoformat(),
+                    'generated_at': seeded_at,
                     'generated_by': faculty_ids[2]
                 },
                 {
@@ -408,7 +529,7 @@ async def initialize_demo_data():
                         {'day': 'Wednesday', 'time': '10:00 AM - 11:00 AM', 'course_id': course_ids[17], 'course_name': 'Physics II', 'room_id': room_ids[12], 'room_name': 'Auditorium B'},
                         {'day': 'Friday', 'time': '9:00 AM - 10:00 AM', 'course_id': course_ids[18], 'course_name': 'Quantum Mechanics', 'room_id': room_ids[5], 'room_name': 'Room 201'},
                     ],
-                    'generated_at': datetime.now(timezone.utc).isoformat(),
+                    'generated_at': seeded_at,
                     'generated_by': faculty_ids[3]
                 },
                 {
@@ -419,7 +540,7 @@ async def initialize_demo_data():
                         {'day': 'Thursday', 'time': '9:00 AM - 10:00 AM', 'course_id': course_ids[21], 'course_name': 'Organic Chemistry', 'room_id': room_ids[7], 'room_name': 'Room 203'},
                         {'day': 'Thursday', 'time': '3:00 PM - 5:00 PM', 'course_id': course_ids[22], 'course_name': 'Organic Chemistry Lab', 'room_id': room_ids[11], 'room_name': 'Lab D'},
                     ],
-                    'generated_at': datetime.now(timezone.utc).isoformat(),
+                    'generated_at': seeded_at,
                     'generated_by': faculty_ids[4]
                 },
                 {
@@ -430,7 +551,7 @@ async def initialize_demo_data():
                         {'day': 'Wednesday', 'time': '11:00 AM - 12:00 PM', 'course_id': course_ids[25], 'course_name': 'Genetics', 'room_id': room_ids[14], 'room_name': 'Seminar Room 2'},
                         {'day': 'Friday', 'time': '10:00 AM - 11:00 AM', 'course_id': course_ids[26], 'course_name': 'Molecular Biology', 'room_id': room_ids[0], 'room_name': 'Room 101'},
                     ],
-                    'generated_at': datetime.now(timezone.utc).isoformat(),
+                    'generated_at': seeded_at,
                     'generated_by': faculty_ids[5]
                 },
                 {
@@ -441,7 +562,7 @@ async def initialize_demo_data():
                         {'day': 'Thursday', 'time': '9:00 AM - 10:00 AM', 'course_id': course_ids[33], 'course_name': 'Technical Writing', 'room_id': room_ids[13], 'room_name': 'Seminar Room 1'},
                         {'day': 'Friday', 'time': '3:00 PM - 4:00 PM', 'course_id': course_ids[34], 'course_name': 'Shakespeare Studies', 'room_id': room_ids[14], 'room_name': 'Seminar Room 2'},
                     ],
-                    'generated_at': datetime.now(timezone.utc).isoformat(),
+                    'generated_at': seeded_at,
                     'generated_by': faculty_ids[6]
                 },
                 {
@@ -452,7 +573,7 @@ async def initialize_demo_data():
                         {'day': 'Thursday', 'time': '2:00 PM - 3:00 PM', 'course_id': course_ids[37], 'course_name': 'International Economics', 'room_id': room_ids[3], 'room_name': 'Room 104'},
                         {'day': 'Friday', 'time': '11:00 AM - 12:00 PM', 'course_id': course_ids[38], 'course_name': 'Financial Economics', 'room_id': room_ids[5], 'room_name': 'Room 201'},
                     ],
-                    'generated_at': datetime.now(timezone.utc).isoformat(),
+                    'generated_at': seeded_at,
                     'generated_by': faculty_ids[7]
                 },
                 {
@@ -463,7 +584,7 @@ async def initialize_demo_data():
                         {'day': 'Thursday', 'time': '10:00 AM - 11:00 AM', 'course_id': course_ids[41], 'course_name': 'Modern History', 'room_id': room_ids[7], 'room_name': 'Room 203'},
                         {'day': 'Friday', 'time': '2:00 PM - 3:00 PM', 'course_id': course_ids[42], 'course_name': 'Ancient Civilizations', 'room_id': room_ids[0], 'room_name': 'Room 101'},
                     ],
-                    'generated_at': datetime.now(timezone.utc).isoformat(),
+                    'generated_at': seeded_at,
                     'generated_by': faculty_ids[8]
                 },
                 {
@@ -474,15 +595,23 @@ async def initialize_demo_data():
                         {'day': 'Wednesday', 'time': '10:00 AM - 11:00 AM', 'course_id': course_ids[45], 'course_name': 'Social Psychology', 'room_id': room_ids[13], 'room_name': 'Seminar Room 1'},
                         {'day': 'Friday', 'time': '9:00 AM - 10:00 AM', 'course_id': course_ids[46], 'course_name': 'Abnormal Psychology', 'room_id': room_ids[14], 'room_name': 'Seminar Room 2'},
                     ],
-                    'generated_at': datetime.now(timezone.utc).isoformat(),
+                    'generated_at': seeded_at,
                     'generated_by': faculty_ids[9]
                 },
             ]
             
-            for ft in faculty_timetables:
-                await db.timetables.insert_one(ft)
+            await db.timetables.insert_many(faculty_timetables)
+            
+            lab_room = next((room for room in rooms if room['type'] == 'lab'), None)
+            classroom = next((room for room in rooms if room['type'] == 'classroom'), None)
+            faculty_names = {str(fac['_id']): f"Dr. {fac['name'].split(' ')[-1]}" for fac in faculty_data}
+            
+            days = DEFAULT_WORKING_DAYS
+            times = ['9:00 AM - 10:00 AM', '10:00 AM - 11:00 AM', '11:00 AM - 12:00 PM', '2:00 PM - 3:00 PM', '3:00 PM - 4:00 PM', '4:00 PM - 5:00 PM']
+            max_slots = len(days) * len(times)
             
             student_timetables = []
+            student_preferences = []
             for i, student_id in enumerate(student_ids):
                 num_courses = 4 + (i % 3)
                 start_idx = i % len(course_ids)
@@ -490,61 +619,40 @@ async def initialize_demo_data():
                 if end_idx > len(course_ids):
                     end_idx = len(course_ids)
                 student_courses = course_ids[start_idx:end_idx]
-                preferences = []
                 for j, course_id in enumerate(student_courses):
-                    preferences.append({
+                    student_preferences.append({
                         'student_id': student_id,
                         'course_id': course_id,
                         'preferred_time': ['morning', 'afternoon', 'no-preference'][j % 3],
                         'preferred_professor': 'no-preference',
                         'priority': (j % 3) + 1,
-                        'created_at': datetime.now(timezone.utc).isoformat()
+                        'created_at': seeded_at
                     })
                 
-                await db.student_course_preferences.insert_many(preferences)
-                
-                days = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday']
-                times = ['9:00 AM - 10:00 AM', '10:00 AM - 11:00 AM', '11:00 AM - 12:00 PM', '2:00 PM - 3:00 PM', '3:00 PM - 4:00 PM', '4:00 PM - 5:00 PM']
-                
                 schedule = []
-                for day_idx, day in enumerate(days):
-                    for time_idx, time in enumerate(times):
-                        if day_idx * len(times) + time_idx < len(student_courses):
-                            course_id = student_courses[day_idx * len(times) + time_idx]
-                            course = await db.courses.find_one({'_id': ObjectId(course_id)})
-                            if course:
-                                suitable_room = None
-                                if course.get('is_lab'):
-                                    suitable_room = await db.rooms.find_one({'type': 'lab'})
-                                else:
-                                    suitable_room = await db.rooms.find_one({'type': 'classroom'})
-                                
-                                if suitable_room:
-                                    if course.get('faculty_id'):
-                                        try:
-                                            faculty_doc = await db.users.find_one({'_id': ObjectId(course.get('faculty_id'))})
-                                            if faculty_doc:
-                                                faculty_name = faculty_doc['name'].split(' ')[-1]
-                                                faculty_name = f"Dr. {faculty_name}"
-                                            else:
-                                                faculty_name = 'TBD'
-                                        except:
-                                            faculty_name = 'TBD'
-                                    else:
-                                        faculty_name = 'TBD'
-                                    
-                                    schedule.append({
-                                        'day': day,
-                                        'time': time,
-                                        'course_id': str(course['_id']),
-                                        'course_name': course['name'],
-                                        'course_code': course['code'],
-                                        'room_id': str(suitable_room['_id']),
-                                        'room_name': suitable_room['name'],
-                                        'faculty_id': str(course.get('faculty_id', '')),
-                                        'faculty_name': faculty_name
-                                    })
-                
+                for slot_idx, course_id in enumerate(student_courses[:max_slots]):
+                    day_idx, time_idx = divmod(slot_idx, len(times))
+                    day = days[day_idx]
+                    slot_time = times[time_idx]
+                    course = courses_by_id.get(course_id)
+                    if course:
+                        suitable_room = lab_room if course.get('is_lab') else classroom
+
+                        if suitable_room:
+                            faculty_name = faculty_names.get(course.get('faculty_id'), 'TBD')
+
+                            schedule.append({
+                                'day': day,
+                                'time': slot_time,
+                                'course_id': str(course['_id']),
+                                'course_name': course['name'],
+                                'course_code': course['code'],
+                                'room_id': str(suitable_room['_id']),
+                                'room_name': suitable_room['name'],
+                                'faculty_id': str(course.get('faculty_id', '')),
+                                'faculty_name': faculty_name
+                            })
+
                 student_timetable = {
                     'schedule': schedule,
                     'summary': f'Timetable for student {i+1}',
@@ -554,20 +662,35 @@ async def initialize_demo_data():
                 }
                 student_timetables.append(student_timetable)
             
+            await db.student_course_preferences.insert_many(student_preferences)
             await db.timetables.insert_many(student_timetables)
+            await db.settings.update_one(
+                {'key': DEMO_SEED_KEY},
+                {'$set': {'value.status': 'done', 'value.completed_at': datetime.now(timezone.utc).isoformat()}}
+            )
             logger.info("Extensive demo data created successfully")
         else:
             logger.info("Demo data already exists")
         
     except Exception as e:
-        logger.error(f"Demo data creation error: {str(e)}")
+        logger.error("Demo data creation error: %s", e)
+        if seed_claimed:
+            try:
+                await db.settings.delete_one({'key': DEMO_SEED_KEY})
+            except Exception as release_error:
+                logger.error("Failed to release demo data seeding claim: %s", release_error)
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    try:
+        await client.admin.command('ping')
+    except Exception as e:
+        logger.error("MongoDB ping failed: %s", e)
     await create_indexes()
     await initialize_demo_data()
     
     yield
+    http_session.close()
     logger.info("Application shutting down")
 
 app = FastAPI(
@@ -576,6 +699,7 @@ app = FastAPI(
     version="1.0.0",
     docs_url="/docs" if IS_DEVELOPMENT else None,
     redoc_url="/redoc" if IS_DEVELOPMENT else None,
+    default_response_class=ORJSONResponse,
     lifespan=lifespan
 )
 
@@ -586,32 +710,61 @@ app.add_middleware(
 
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["http://localhost:3000", "http://127.0.0.1:3000"],
+    allow_origins=[
+        origin.strip()
+        for origin in os.environ.get('CORS_ORIGINS', 'http://localhost:3000,http://127.0.0.1:3000').split(',')
+        if origin.strip()
+    ],
     allow_credentials=True,
     allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
-    allow_headers=["*"],
+    allow_headers=["Authorization", "Content-Type", "If-None-Match"],
+    max_age=86400,
 )
 
-app.add_middleware(GZipMiddleware, minimum_size=500)
+app.add_middleware(GZipMiddleware, minimum_size=1024, compresslevel=5)
 
 @app.exception_handler(Exception)
 async def global_exception_handler(request: Request, exc: Exception):
-    logger.error(f"Global exception: {str(exc)}")
-    return JSONResponse(
+    logger.error("Global exception: %s", exc, exc_info=exc)
+    return ORJSONResponse(
         status_code=500,
         content={"detail": "Internal server error", "error": str(exc) if IS_DEVELOPMENT else None}
     )
 
+def redact_password_fields(value):
+    if isinstance(value, dict):
+        return {
+            key: '***' if 'password' in str(key) else redact_password_fields(item)
+            for key, item in value.items()
+        }
+    if isinstance(value, (list, tuple)):
+        return [redact_password_fields(item) for item in value]
+    return value
+
+def redact_passwords(body):
+    if isinstance(body, bytes):
+        return f'<{len(body)} bytes>'
+    if isinstance(body, str):
+        return f'<{len(body)} chars>'
+    return redact_password_fields(body)
+
+def redact_validation_errors(errors):
+    return [
+        {**error, 'input': '***'} if any('password' in str(part) for part in error['loc']) else error
+        for error in errors
+    ]
+
 @app.exception_handler(RequestValidationError)
 async def validation_exception_handler(request: Request, exc: RequestValidationError):
-    logger.error(f"Validation error: {exc.errors()}")
-    logger.error(f"Request body: {exc.body}")
+    validation_errors = exc.errors()
+    logger.error("Validation error: %s", redact_validation_errors(validation_errors))
+    logger.debug("Rejected request body: %s", redact_passwords(exc.body))
     errors = {}
-    for error in exc.errors():
+    for error in validation_errors:
         field = ".".join(str(x) for x in error["loc"])
         errors[field] = error["msg"]
     
-    return JSONResponse(
+    return ORJSONResponse(
         status_code=422,
         content={"detail": "Validation failed", "errors": errors}
     )
@@ -627,7 +780,7 @@ def generate_token(user_id, email, role):
         'user_id': user_id,
         'email': email,
         'role': role,
-        'exp': datetime.now(timezone.utc) + timedelta(hours=JWT_EXPIRATION_HOURS)
+        'exp': datetime.now(timezone.utc) + JWT_EXPIRATION
     }
     return jwt.encode(payload, JWT_SECRET, algorithm=JWT_ALGORITHM)
 
@@ -639,6 +792,17 @@ def decode_token(token):
     except jwt.InvalidTokenError:
         return None
 
+def strip_code_fences(text):
+    return CODE_FENCE_PATTERN.sub('', text).strip()
+
+def extract_json_text(text):
+    text = strip_code_fences(text)
+    start = text.find('{')
+    end = text.rfind('}')
+    if start != -1 and end > start:
+        return text[start:end + 1]
+    return text
+
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
     token = credentials.credentials
     payload = decode_token(token)
@@ -654,10 +818,225 @@ def require_role(allowed_roles: List[str]):
     return role_checker
 
 async def notify_users(message: str):
-    logger.info(f"Notifying users: {message}")
+    logger.info("Notifying users: %s", message)
 
 async def process_timetable_update(timetable_id: str):
-    logger.info(f"Processing timetable update for {timetable_id}")
+    logger.info("Processing timetable update for %s", timetable_id)
+
+def parse_course_ids(course_ids):
+    if not all(ObjectId.is_valid(course_id) for course_id in course_ids):
+        raise HTTPException(status_code=400, detail='Invalid course ID format')
+    return [ObjectId(course_id) for course_id in course_ids]
+
+async def get_cached_setting(key, loader):
+    return await settings_cache.get_or_load(key, loader)
+
+def invalidate_setting(key):
+    settings_cache.invalidate(key)
+
+async def load_course_page(skip, limit):
+    courses = await db.courses.find({}).skip(skip).limit(limit).to_list(limit)
+    for course in courses:
+        course['_id'] = str(course['_id'])
+        if 'faculty_id' in course and course['faculty_id']:
+            course['faculty_id'] = str(course['faculty_id'])
+    return orjson.dumps(courses, default=str)
+
+async def get_cached_courses(skip, limit):
+    return await course_list_cache.get_or_load((skip, limit), lambda: load_course_page(skip, limit))
+
+def invalidate_courses():
+    course_list_cache.invalidate()
+
+async def load_schedule_usage(selected_course_ids):
+    slot_occupancy = {}
+    occupancy_cursor = db.timetables.aggregate([
+        {'$match': {'schedule.course_id': {'$in': selected_course_ids}}},
+        {'$unwind': '$schedule'},
+        {'$match': {'schedule.course_id': {'$in': selected_course_ids}}},
+        {'$group': {'_id': {
+            'timetable_id': '$_id',
+            'course_id': '$schedule.course_id',
+            'room_id': '$schedule.room_id',
+            'day': '$schedule.day',
+            'time': '$schedule.time'
+        }}},
+        {'$group': {'_id': {
+            'course_id': '$_id.course_id',
+            'room_id': '$_id.room_id',
+            'day': '$_id.day',
+            'time': '$_id.time'
+        }, 'count': {'$sum': 1}}}
+    ])
+    async for row in occupancy_cursor:
+        slot_key = (row['_id'].get('course_id'), row['_id'].get('room_id'), row['_id'].get('day'), row['_id'].get('time'))
+        slot_occupancy[slot_key] = row['count']
+    
+    existing_slots = await db.timetables.aggregate([
+        {'$match': {'student_id': {'$ne': None}}},
+        {'$limit': 1000},
+        {'$unwind': '$schedule'},
+        {'$match': {'schedule.course_id': {'$in': selected_course_ids}}},
+        {'$project': {
+            '_id': 0,
+            'course_id': '$schedule.course_id',
+            'day': '$schedule.day',
+            'time': '$schedule.time',
+            'room_id': '$schedule.room_id',
+            'room_name': '$schedule.room_name'
+        }}
+    ]).to_list(length=None)
+    return slot_occupancy, existing_slots
+
+async def get_schedule_usage(selected_course_ids):
+    return await schedule_usage_cache.get_or_load(
+        tuple(selected_course_ids), lambda: load_schedule_usage(selected_course_ids)
+    )
+
+def invalidate_schedule_usage():
+    schedule_usage_cache.invalidate()
+
+async def load_base_timetable_json():
+    base_timetable = await get_cached_setting('base_timetable', load_base_timetable)
+    return prompt_json(base_timetable) if base_timetable else "{}"
+
+async def load_credit_limits():
+    setting = await db.settings.find_one({'key': 'credit_limits'})
+    if not setting:
+        return DEFAULT_CREDIT_LIMITS
+    return setting.get('value', DEFAULT_CREDIT_LIMITS)
+
+async def load_base_timetable():
+    base_timetable = await db.base_timetables.find_one(sort=[('created_at', -1)])
+    if base_timetable:
+        base_timetable['_id'] = str(base_timetable['_id'])
+    return base_timetable
+
+def etag_matches(if_none_match, etag):
+    if not if_none_match:
+        return False
+    for tag in if_none_match.split(','):
+        tag = tag.strip()
+        if tag == '*':
+            return True
+        if tag.startswith('W/'):
+            tag = tag[2:]
+        if tag == etag:
+            return True
+    return False
+
+def conditional_response(request, payload):
+    response = ORJSONResponse(payload)
+    etag = f'"{hashlib.blake2b(response.body, digest_size=16).hexdigest()}"'
+    headers = {'ETag': etag, 'Cache-Control': 'private, no-cache'}
+    if etag_matches(request.headers.get('if-none-match'), etag):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return response
+
+async def find_schedule_page(query, skip, size):
+    schedule = {'$ifNull': ['$schedule', []]}
+    cursor = db.timetables.aggregate([
+        {'$match': query},
+        {'$sort': {'generated_at': -1}},
+        {'$limit': 1},
+        {'$project': {
+            'summary': 1,
+            'generated_at': 1,
+            'generated_by': 1,
+            'total': {'$size': schedule},
+            'schedule': {'$slice': [schedule, skip, size]}
+        }}
+    ])
+    pages = await cursor.to_list(1)
+    return pages[0] if pages else None
+
+def prompt_json(data):
+    return orjson.dumps(data, default=str, option=orjson.OPT_INDENT_2).decode('utf-8')
+
+def ai_cache_key(prompt):
+    return hashlib.blake2b(f"{OPENROUTER_MODEL}\n{prompt}".encode('utf-8'), digest_size=16).hexdigest()
+
+async def get_ai_response(cache_key):
+    async with ai_cache_lock:
+        cached = ai_response_cache.get(cache_key)
+        if not cached:
+            return None
+        if cached[0] <= time.monotonic():
+            del ai_response_cache[cache_key]
+            return None
+        ai_response_cache.move_to_end(cache_key)
+        return cached[1]
+
+async def store_ai_response(cache_key, timetable_data):
+    if AI_CACHE_MAX_ENTRIES <= 0:
+        return
+    async with ai_cache_lock:
+        ai_response_cache[cache_key] = (time.monotonic() + AI_CACHE_TTL_SECONDS, timetable_data)
+        ai_response_cache.move_to_end(cache_key)
+        while len(ai_response_cache) > AI_CACHE_MAX_ENTRIES:
+            ai_response_cache.popitem(last=False)
+
+async def request_ai_timetable(prompt, refresh=False):
+    cache_key = ai_cache_key(prompt)
+    if not refresh:
+        cached = await get_ai_response(cache_key)
+        if cached is not None:
+            return cache_key, cached, True
+    
+    async with ai_cache_lock:
+        task = ai_inflight_requests.get(cache_key)
+        if task is None:
+            task = asyncio.ensure_future(fetch_ai_timetable(prompt, cache_key))
+            ai_inflight_requests[cache_key] = task
+            task.add_done_callback(lambda _: ai_inflight_requests.pop(cache_key, None))
+    return cache_key, await asyncio.shield(task), False
+
+async def find_generated_timetable(prompt_hash, query):
+    timetable = await db.timetables.find_one({'prompt_hash': prompt_hash, **query}, sort=[('generated_at', -1)])
+    if timetable:
+        timetable['_id'] = str(timetable['_id'])
+    return timetable
+
+async def fetch_ai_timetable(prompt, cache_key):
+    try:
+        response = await run_in_threadpool(
+            http_session.post,
+            url="https://openrouter.ai/api/v1/chat/completions",
+            headers={
+                "Authorization": f"Bearer {OPENROUTER_API_KEY}",
+                "Content-Type": "application/json",
+            },
+            data=orjson.dumps({
+                "model": OPENROUTER_MODEL,
+                "messages": [
+                    {
+                        "role": "user",
+                        "content": prompt
+                    }
+                ]
+            }),
+            timeout=OPENROUTER_TIMEOUT_SECONDS
+        )
+    except requests.exceptions.RequestException as e:
+        logger.error("Request to OpenRouter failed: %s", e)
+        raise HTTPException(status_code=500, detail='Failed to connect to AI service')
+    
+    if response.status_code != 200:
+        logger.error("OpenRouter API error: %s - %s", response.status_code, response.text)
+        raise HTTPException(status_code=500, detail='Failed to generate timetable')
+    
+    response_text = ''
+    try:
+        response_text = orjson.loads(response.content)['choices'][0]['message']['content']
+        timetable_data = orjson.loads(extract_json_text(response_text))
+    except (orjson.JSONDecodeError, KeyError) as e:
+        logger.error("JSON decode error: %s", e)
+        logger.debug("AI Response: %s", response_text)
+        raise HTTPException(status_code=500, detail='Failed to parse AI response')
+    
+    await store_ai_response(cache_key, timetable_data)
+    return timetable_data
 
 @app.post('/api/v1/auth/register')
 async def register(request: Request, data: RegisterRequest):
@@ -667,7 +1046,7 @@ async def register(request: Request, data: RegisterRequest):
             raise HTTPException(status_code=400, detail='User already exists')
         user_data = {
             'email': data.email,
-            'password_hash': hash_password(data.password),
+            'password_hash': await run_in_threadpool(hash_password, data.password),
             'name': data.name,
             'role': data.role,
             'created_at': datetime.now(timezone.utc).isoformat()
@@ -690,7 +1069,7 @@ async def register(request: Request, data: RegisterRequest):
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Register error: {str(e)}")
+        logger.error("Register error: %s", e)
         raise HTTPException(status_code=500, detail='Registration failed')
 
 @app.post('/api/v1/auth/login')
@@ -698,11 +1077,11 @@ async def login(request: Request, data: LoginRequest):
     try:
         user = await db.users.find_one({'email': data.email})
         if not user:
-            logger.warning(f"Login failed for email {data.email}: User not found.")
+            logger.warning("Login failed for email %s: User not found.", data.email)
             raise HTTPException(status_code=401, detail='Invalid credentials')
         
-        if not verify_password(data.password, user['password_hash']):
-            logger.warning(f"Login failed for email {data.email}: Password does not match.")
+        if not await run_in_threadpool(verify_password, data.password, user['password_hash']):
+            logger.warning("Login failed for email %s: Password does not match.", data.email)
             raise HTTPException(status_code=401, detail='Invalid credentials')
         
         user_id = str(user['_id'])
@@ -720,7 +1099,7 @@ async def login(request: Request, data: LoginRequest):
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Login error: {str(e)}")
+        logger.error("Login error: %s", e)
         raise HTTPException(status_code=500, detail='Login failed')
 
 @app.post('/api/v1/auth/logout')
@@ -741,19 +1120,19 @@ async def update_password(
         if not user_doc:
             raise HTTPException(status_code=404, detail='User not found')
         
-        if not verify_password(data.current_password, user_doc['password_hash']):
+        if not await run_in_threadpool(verify_password, data.current_password, user_doc['password_hash']):
             raise HTTPException(status_code=401, detail='Current password is incorrect')
         
         await db.users.update_one(
             {'_id': ObjectId(user_id)},
-            {'$set': {'password_hash': hash_password(data.new_password)}}
+            {'$set': {'password_hash': await run_in_threadpool(hash_password, data.new_password)}}
         )
         
         return {'message': 'Password updated successfully'}
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Update password error: {str(e)}")
+        logger.error("Update password error: %s", e)
         raise HTTPException(status_code=500, detail='Failed to update password')
 
 @app.get('/api/v1/dashboard/stats')
@@ -762,10 +1141,12 @@ async def get_dashboard_stats(
     user: dict = Depends(require_role(['admin']))
 ):
     try:
-        total_students = await db.users.count_documents({'role': 'student'})
-        total_faculty = await db.users.count_documents({'role': 'faculty'})
-        total_courses = await db.courses.count_documents({})
-        total_rooms = await db.rooms.count_documents({})
+        total_students, total_faculty, total_courses, total_rooms = await asyncio.gather(
+            db.users.count_documents({'role': 'student'}),
+            db.users.count_documents({'role': 'faculty'}),
+            db.courses.count_documents({}),
+            db.rooms.count_documents({})
+        )
         
         return {
             'total_students': total_students,
@@ -776,7 +1157,7 @@ async def get_dashboard_stats(
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Stats error: {str(e)}")
+        logger.error("Stats error: %s", e)
         raise HTTPException(status_code=500, detail='Failed to fetch stats')
 
 @app.get('/api/v1/courses')
@@ -787,16 +1168,11 @@ async def get_courses(
     user: dict = Depends(get_current_user)
 ):
     try:
-        courses = await db.courses.find({}).skip(skip).limit(limit).to_list(1000)
-        for course in courses:
-            course['_id'] = str(course['_id'])
-            if 'faculty_id' in course and course['faculty_id']:
-                course['faculty_id'] = str(course['faculty_id'])
-        return courses
+        return Response(content=await get_cached_courses(skip, limit), media_type='application/json')
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Get courses error: {str(e)}")
+        logger.error("Get courses error: %s", e)
         raise HTTPException(status_code=500, detail='Failed to fetch courses')
 
 @app.post('/api/v1/courses')
@@ -821,12 +1197,13 @@ async def create_course(
         
         result = await db.courses.insert_one(course)
         course['_id'] = str(result.inserted_id)
+        invalidate_courses()
         
         return course
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Create course error: {str(e)}")
+        logger.error("Create course error: %s", e)
         raise HTTPException(status_code=500, detail='Failed to create course')
 
 @app.put('/api/v1/courses/{course_id}')
@@ -870,9 +1247,11 @@ async def update_course(
         
         update_data['updated_at'] = datetime.now(timezone.utc).isoformat()
         
-        await db.courses.update_one({'_id': obj_id}, {'$set': update_data})
+        course = await db.courses.find_one_and_update(
+            {'_id': obj_id}, {'$set': update_data}, return_document=ReturnDocument.AFTER
+        )
+        invalidate_courses()
         
-        course = await db.courses.find_one({'_id': obj_id})
         course['_id'] = str(course['_id'])
         if 'faculty_id' in course and course['faculty_id']:
             course['faculty_id'] = str(course['faculty_id'])
@@ -881,7 +1260,7 @@ async def update_course(
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Update course error: {str(e)}")
+        logger.error("Update course error: %s", e)
         raise HTTPException(status_code=500, detail='Failed to update course')
 
 @app.delete('/api/v1/courses/{course_id}')
@@ -899,12 +1278,13 @@ async def delete_course(
         if not existing_course:
             raise HTTPException(status_code=404, detail='Course not found')
         await db.courses.delete_one({'_id': obj_id})
+        invalidate_courses()
         
         return {'message': 'Course deleted successfully'}
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Delete course error: {str(e)}")
+        logger.error("Delete course error: %s", e)
         raise HTTPException(status_code=500, detail='Failed to delete course')
 
 @app.get('/api/v1/users')
@@ -915,15 +1295,15 @@ async def get_users(
     user: dict = Depends(require_role(['admin']))
 ):
     try:
-        users = await db.users.find({}, {'password_hash': 0}).skip(skip).limit(limit).to_list(1000)
+        users = await db.users.find({}, {'password_hash': 0}).skip(skip).limit(limit).to_list(limit)
         for u in users:
             u['_id'] = str(u['_id'])
             
-        return users
+        return ORJSONResponse(users)
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Get users error: {str(e)}")
+        logger.error("Get users error: %s", e)
         raise HTTPException(status_code=500, detail='Failed to fetch users')
 
 @app.post('/api/v1/users')
@@ -939,7 +1319,7 @@ async def create_user(
         
         new_user = {
             'email': data.email,
-            'password_hash': hash_password(data.password),
+            'password_hash': await run_in_threadpool(hash_password, data.password),
             'name': data.name,
             'role': data.role,
             'created_at': datetime.now(timezone.utc).isoformat()
@@ -958,7 +1338,7 @@ async def create_user(
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Create user error: {str(e)}")
+        logger.error("Create user error: %s", e)
         raise HTTPException(status_code=500, detail='Failed to create user')
 
 @app.get('/api/v1/users/{user_id}')
@@ -982,7 +1362,7 @@ async def get_user(
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Get user error: {str(e)}")
+        logger.error("Get user error: %s", e)
         raise HTTPException(status_code=500, detail='Failed to fetch user')
 
 @app.put('/api/v1/users/{user_id}')
@@ -1002,28 +1382,34 @@ async def update_user(
         if not existing_user:
             raise HTTPException(status_code=404, detail='User not found')
         
-        if user_id == current_user.get('user_id') and 'role' in data.model_dump():
-            del data.role
+        update_data = data.model_dump(exclude_unset=True)
+        if user_id == current_user.get('user_id'):
+            update_data.pop('role', None)
         
         if data.email and existing_user['email'] != data.email:
             email_exists = await db.users.find_one({'email': data.email, '_id': {'$ne': obj_id}})
             if email_exists:
                 raise HTTPException(status_code=400, detail='Email already exists')
         
-        update_data = data.model_dump(exclude_unset=True)
         if update_data:
             update_data['updated_at'] = datetime.now(timezone.utc).isoformat()
+            user = await db.users.find_one_and_update(
+                {'_id': obj_id},
+                {'$set': update_data},
+                projection={'password_hash': 0},
+                return_document=ReturnDocument.AFTER
+            )
+        else:
+            user = existing_user
+            user.pop('password_hash', None)
         
-        await db.users.update_one({'_id': obj_id}, {'$set': update_data})
-        
-        user = await db.users.find_one({'_id': obj_id}, {'password_hash': 0})
         user['_id'] = str(user['_id'])
         
         return user
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Update user error: {str(e)}")
+        logger.error("Update user error: %s", e)
         raise HTTPException(status_code=500, detail='Failed to update user')
 
 @app.delete('/api/v1/users/{user_id}')
@@ -1051,7 +1437,7 @@ async def delete_user(
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Delete user error: {str(e)}")
+        logger.error("Delete user error: %s", e)
         raise HTTPException(status_code=500, detail='Failed to delete user')
 
 @app.get('/api/v1/rooms')
@@ -1062,15 +1448,15 @@ async def get_rooms(
     user: dict = Depends(get_current_user)
 ):
     try:
-        rooms = await db.rooms.find({}).skip(skip).limit(limit).to_list(1000)
+        rooms = await db.rooms.find({}).skip(skip).limit(limit).to_list(limit)
         for room in rooms:
             room['_id'] = str(room['_id'])
             
-        return rooms
+        return ORJSONResponse(rooms)
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Get rooms error: {str(e)}")
+        logger.error("Get rooms error: %s", e)
         raise HTTPException(status_code=500, detail='Failed to fetch rooms')
 
 @app.post('/api/v1/rooms')
@@ -1098,7 +1484,7 @@ async def create_room(
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Create room error: {str(e)}")
+        logger.error("Create room error: %s", e)
         raise HTTPException(status_code=500, detail='Failed to create room')
 
 @app.put('/api/v1/rooms/{room_id}')
@@ -1131,16 +1517,16 @@ async def update_room(
         
         update_data['updated_at'] = datetime.now(timezone.utc).isoformat()
         
-        await db.rooms.update_one({'_id': obj_id}, {'$set': update_data})
-        
-        room = await db.rooms.find_one({'_id': obj_id})
+        room = await db.rooms.find_one_and_update(
+            {'_id': obj_id}, {'$set': update_data}, return_document=ReturnDocument.AFTER
+        )
         room['_id'] = str(room['_id'])
         
         return room
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Update room error: {str(e)}")
+        logger.error("Update room error: %s", e)
         raise HTTPException(status_code=500, detail='Failed to update room')
 
 @app.delete('/api/v1/rooms/{room_id}')
@@ -1165,7 +1551,7 @@ async def delete_room(
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Delete room error: {str(e)}")
+        logger.error("Delete room error: %s", e)
         raise HTTPException(status_code=500, detail='Failed to delete room')
         
 @app.get('/api/v1/timetable/base')
@@ -1174,16 +1560,11 @@ async def get_base_timetable(
     user: dict = Depends(require_role(['admin', 'faculty']))
 ):
     try:
-        base_timetable = await db.base_timetables.find_one(sort=[('created_at', -1)])
-        if not base_timetable:
-            return None
-        
-        base_timetable['_id'] = str(base_timetable['_id'])
-        return base_timetable
+        return conditional_response(request, await get_cached_setting('base_timetable', load_base_timetable))
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Get base timetable error: {str(e)}")
+        logger.error("Get base timetable error: %s", e)
         raise HTTPException(status_code=500, detail='Failed to fetch base timetable')
 
 @app.post('/api/v1/timetable/base')
@@ -1214,9 +1595,12 @@ async def create_base_timetable(
                 'updated_at': datetime.now(timezone.utc).isoformat()
             }
             
-            await db.base_timetables.update_one({}, {'$set': update_data})
+            base_timetable = await db.base_timetables.find_one_and_update(
+                {}, {'$set': update_data}, return_document=ReturnDocument.AFTER
+            )
+            invalidate_setting('base_timetable')
+            invalidate_setting('base_timetable_json')
             
-            base_timetable = await db.base_timetables.find_one()
             base_timetable['_id'] = str(base_timetable['_id'])
             return base_timetable
         else:
@@ -1233,13 +1617,15 @@ async def create_base_timetable(
             }
             
             result = await db.base_timetables.insert_one(base_timetable)
+            invalidate_setting('base_timetable')
+            invalidate_setting('base_timetable_json')
             base_timetable['_id'] = str(result.inserted_id)
             
             return base_timetable
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Create base timetable error: {str(e)}")
+        logger.error("Create base timetable error: %s", e)
         raise HTTPException(status_code=500, detail='Failed to create base timetable')
 
 @app.get('/api/v1/settings/credit-limits')
@@ -1248,22 +1634,11 @@ async def get_credit_limits(
     user: dict = Depends(get_current_user)
 ):
     try:
-        setting = await db.settings.find_one({'key': 'credit_limits'})
-        
-        if not setting:
-            return {
-                'minCredits': 15,
-                'maxCredits': 25
-            }
-        
-        return setting.get('value', {
-            'minCredits': 15,
-            'maxCredits': 25
-        })
+        return conditional_response(request, await get_cached_setting('credit_limits', load_credit_limits))
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Get credit limits error: {str(e)}")
+        logger.error("Get credit limits error: %s", e)
         raise HTTPException(status_code=500, detail='Failed to fetch credit limits')
 
 @app.post('/api/v1/settings/credit-limits')
@@ -1298,6 +1673,8 @@ async def update_credit_limits(
                 'created_at': datetime.now(timezone.utc).isoformat()
             })
         
+        invalidate_setting('credit_limits')
+        
         return {
             'minCredits': data.minCredits,
             'maxCredits': data.maxCredits
@@ -1305,31 +1682,27 @@ async def update_credit_limits(
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Update credit limits error: {str(e)}")
+        logger.error("Update credit limits error: %s", e)
         raise HTTPException(status_code=500, detail='Failed to update credit limits')
 
 @app.post('/api/v1/timetable/generate')
 async def generate_timetable(
     request: Request,
     background_tasks: BackgroundTasks,
-    user: dict = Depends(require_role(['faculty', 'student']))
+    user: dict = Depends(require_role(['faculty', 'student'])),
+    refresh: bool = Query(False, description=REFRESH_QUERY_DESCRIPTION)
 ):
     try:
         if not OPENROUTER_API_KEY:
             raise HTTPException(status_code=500, detail='AI generation service is not configured')
             
-        courses = await db.courses.find({}).to_list(1000)
-        rooms = await db.rooms.find({}).to_list(1000)
-        faculty = await db.users.find({'role': 'faculty'}, {'password_hash': 0}).to_list(1000)
-        
-        credit_limits_setting = await db.settings.find_one({'key': 'credit_limits'})
-        credit_limits = credit_limits_setting.get('value', {
-            'minCredits': 15,
-            'maxCredits': 25
-        }) if credit_limits_setting else {
-            'minCredits': 15,
-            'maxCredits': 25
-        }
+        courses = await db.courses.find({}, {
+            'name': 1, 'code': 1, 'credits': 1, 'category': 1, 'duration_hours': 1, 'is_lab': 1, 'faculty_id': 1
+        }).to_list(1000)
+        rooms = await db.rooms.find({}, {'name': 1, 'capacity': 1, 'type': 1}).to_list(1000)
+        faculty = await db.users.find({'role': 'faculty'}, {'name': 1, 'email': 1}).to_list(1000)
+        
+        credit_limits = await get_cached_setting('credit_limits', load_credit_limits)
         
         courses_data = []
         for course in courses:
@@ -1384,11 +1757,11 @@ Generate a weekly timetable following these constraints:
    - Student timetables should have between {credit_limits['minCredits']} and {credit_limits['maxCredits']} credits
 
 4. DATA:
-Courses: {json.dumps(courses_data, indent=2)}
+Courses: {prompt_json(courses_data)}
 
-Rooms: {json.dumps(rooms_data, indent=2)}
+Rooms: {prompt_json(rooms_data)}
 
-Faculty: {json.dumps(faculty_data, indent=2)}
+Faculty: {prompt_json(faculty_data)}
 
 Generate a JSON response with this structure:
 {{
@@ -1411,66 +1784,32 @@ Generate a JSON response with this structure:
 Return ONLY valid JSON, no markdown formatting.
 """
         
-        try:
-            response = requests.post(
-                url="https://openrouter.ai/api/v1/chat/completions",
-                headers={
-                    "Authorization": f"Bearer {OPENROUTER_API_KEY}",
-                    "Content-Type": "application/json",
-                },
-                data=json.dumps({
-                    "model": OPENROUTER_MODEL,
-                    "messages": [
-                        {
-                            "role": "user",
-                            "content": prompt
-                        }
-                    ]
-                }),
-                timeout=None
-            )
-            
-            if response.status_code != 200:
-                logger.error(f"OpenRouter API error: {response.status_code} - {response.text}")
-                raise HTTPException(status_code=500, detail='Failed to generate timetable')
-            
-            try:
-                response_text = response.json()['choices'][0]['message']['content']
-                if response_text.startswith('```json'):
-                    response_text = response_text[7:]
-                if response_text.startswith('```'):
-                    response_text = response_text[3:]
-                if response_text.endswith('```'):
-                    response_text = response_text[:-3]
-                
-                timetable_data = json.loads(response_text.strip())
-            except (json.JSONDecodeError, KeyError) as e:
-                logger.error(f"JSON decode error: {str(e)}")
-                logger.error(f"AI Response: {response_text}")
-                raise HTTPException(status_code=500, detail='Failed to parse AI response')
-            
-            timetable_record = {
-                'schedule': timetable_data.get('schedule', []),
-                'summary': timetable_data.get('summary', ''),
-                'generated_at': datetime.now(timezone.utc).isoformat(),
-                'generated_by': user.get('user_id')
-            }
-            
-            result = await db.timetables.insert_one(timetable_record)
-            timetable_record['_id'] = str(result.inserted_id)
-            
-            background_tasks.add_task(notify_users, "New timetable has been generated")
-            
-            return timetable_record
-            
-        except requests.exceptions.RequestException as e:
-            logger.error(f"Request to OpenRouter failed: {str(e)}")
-            raise HTTPException(status_code=500, detail='Failed to connect to AI service')
+        prompt_hash, timetable_data, from_cache = await request_ai_timetable(prompt, refresh)
+        if from_cache:
+            existing_timetable = await find_generated_timetable(prompt_hash, {'student_id': None})
+            if existing_timetable:
+                return existing_timetable
+        
+        timetable_record = {
+            'schedule': timetable_data.get('schedule', []),
+            'summary': timetable_data.get('summary', ''),
+            'generated_at': datetime.now(timezone.utc).isoformat(),
+            'generated_by': user.get('user_id'),
+            'prompt_hash': prompt_hash
+        }
+
+        result = await db.timetables.insert_one(timetable_record)
+        invalidate_schedule_usage()
+        timetable_record['_id'] = str(result.inserted_id)
+
+        background_tasks.add_task(notify_users, "New timetable has been generated")
+
+        return timetable_record
         
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Generate timetable error: {str(e)}")
+        logger.error("Generate timetable error: %s", e)
         raise HTTPException(status_code=500, detail=f'Failed to generate timetable: {str(e)}')
 
 @app.get('/api/v1/timetable/latest')
@@ -1481,17 +1820,15 @@ async def get_latest_timetable(
     user: dict = Depends(get_current_user)
 ):
     try:
-        timetable = await db.timetables.find_one(sort=[('generated_at', -1)])
+        timetable = await find_schedule_page({}, (page - 1) * size, size)
         
         if not timetable:
             raise HTTPException(status_code=404, detail='No timetable found')
         
-        schedule = timetable.get('schedule', [])
-        total = len(schedule)
-        skip = (page - 1) * size
-        paginated_schedule = schedule[skip:skip + size]
+        total = timetable['total']
+        paginated_schedule = timetable['schedule']
         
-        return {
+        return ORJSONResponse({
             '_id': str(timetable['_id']),
             'summary': timetable.get('summary', ''),
             'generated_at': timetable.get('generated_at'),
@@ -1503,11 +1840,11 @@ async def get_latest_timetable(
                 'total': total,
                 'pages': (total + size - 1) // size
             }
-        }
+        })
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Get timetable error: {str(e)}")
+        logger.error("Get timetable error: %s", e)
         raise HTTPException(status_code=500, detail='Failed to fetch timetable')
 
 @app.get('/api/v1/timetable/all')
@@ -1515,18 +1852,20 @@ async def get_all_timetables(
     request: Request,
     skip: int = Query(0, ge=0),
     limit: int = Query(10, ge=1, le=100),
+    include_schedule: bool = Query(True),
     user: dict = Depends(require_role(['admin']))
 ):
     try:
-        timetables = await db.timetables.find({}).sort('generated_at', -1).skip(skip).limit(limit).to_list(1000)
+        projection = None if include_schedule else {'schedule': 0}
+        timetables = await db.timetables.find({}, projection).sort('generated_at', -1).skip(skip).limit(limit).to_list(limit)
         for timetable in timetables:
             timetable['_id'] = str(timetable['_id'])
             
-        return timetables
+        return ORJSONResponse(timetables)
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Get all timetables error: {str(e)}")
+        logger.error("Get all timetables error: %s", e)
         raise HTTPException(status_code=500, detail='Failed to fetch timetables')
 
 @app.get('/api/v1/faculty/schedule')
@@ -1538,17 +1877,15 @@ async def get_faculty_schedule(
 ):
     try:
         faculty_id = user.get('user_id')
-        timetable = await db.timetables.find_one({'faculty_id': faculty_id}, sort=[('generated_at', -1)])
+        timetable = await find_schedule_page({'faculty_id': faculty_id}, (page - 1) * size, size)
         
         if not timetable:
-            return {'schedule': [], 'pagination': {'page': page, 'size': size, 'total': 0, 'pages': 0}}
+            return ORJSONResponse({'schedule': [], 'pagination': {'page': page, 'size': size, 'total': 0, 'pages': 0}})
         
-        schedule = timetable.get('schedule', [])
-        total = len(schedule)
-        skip = (page - 1) * size
-        paginated_schedule = schedule[skip:skip + size]
+        total = timetable['total']
+        paginated_schedule = timetable['schedule']
         
-        return {
+        return ORJSONResponse({
             'schedule': paginated_schedule,
             'pagination': {
                 'page': page,
@@ -1556,11 +1893,11 @@ async def get_faculty_schedule(
                 'total': total,
                 'pages': (total + size - 1) // size
             }
-        }
+        })
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Get faculty schedule error: {str(e)}")
+        logger.error("Get faculty schedule error: %s", e)
         raise HTTPException(status_code=500, detail='Failed to fetch schedule')
 
 @app.get('/api/v1/student/schedule')
@@ -1572,17 +1909,15 @@ async def get_student_schedule(
 ):
     try:
         student_id = user.get('user_id')
-        timetable = await db.timetables.find_one({'student_id': student_id}, sort=[('generated_at', -1)])
+        timetable = await find_schedule_page({'student_id': student_id}, (page - 1) * size, size)
         
         if not timetable:
-            return {'schedule': [], 'pagination': {'page': page, 'size': size, 'total': 0, 'pages': 0}}
+            return ORJSONResponse({'schedule': [], 'pagination': {'page': page, 'size': size, 'total': 0, 'pages': 0}})
         
-        schedule = timetable.get('schedule', [])
-        total = len(schedule)
-        skip = (page - 1) * size
-        paginated_schedule = schedule[skip:skip + size]
+        total = timetable['total']
+        paginated_schedule = timetable['schedule']
         
-        return {
+        return ORJSONResponse({
             'schedule': paginated_schedule,
             'pagination': {
                 'page': page,
@@ -1590,11 +1925,11 @@ async def get_student_schedule(
                 'total': total,
                 'pages': (total + size - 1) // size
             }
-        }
+        })
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Get student schedule error: {str(e)}")
+        logger.error("Get student schedule error: %s", e)
         raise HTTPException(status_code=500, detail='Failed to fetch schedule')
 
 @app.get('/api/v1/faculty/courses')
@@ -1625,21 +1960,21 @@ async def get_faculty_courses(
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Get faculty courses error: {str(e)}")
+        logger.error("Get faculty courses error: %s", e)
         raise HTTPException(status_code=500, detail='Failed to fetch faculty courses')
 
 @app.put('/api/v1/faculty/courses')
 async def update_faculty_courses(
     request: Request,
-    data: dict,
+    data: FacultyCoursesRequest,
     user: dict = Depends(require_role(['faculty']))
 ):
     try:
         faculty_id = user.get('user_id')
-        course_ids = data.get('courseIds', [])
+        course_ids = data.courseIds
         
         if course_ids:
-            course_object_ids = [ObjectId(course_id) for course_id in course_ids]
+            course_object_ids = parse_course_ids(course_ids)
             existing_courses = await db.courses.find({'_id': {'$in': course_object_ids}}).to_list(len(course_ids))
             
             if len(existing_courses) != len(course_ids):
@@ -1654,7 +1989,7 @@ async def update_faculty_courses(
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Update faculty courses error: {str(e)}")
+        logger.error("Update faculty courses error: %s", e)
         raise HTTPException(status_code=500, detail='Failed to update faculty courses')
 
 @app.get('/api/v1/admin/profile')
@@ -1682,60 +2017,62 @@ async def get_admin_profile(
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Get admin profile error: {str(e)}")
+        logger.error("Get admin profile error: %s", e)
         raise HTTPException(status_code=500, detail='Failed to fetch profile')
     
 @app.put('/api/v1/faculty/timetable-preferences')
 async def update_faculty_timetable_preferences(
     request: Request,
-    data: dict,
+    data: TimetablePreferencesRequest,
     user: dict = Depends(require_role(['faculty']))
 ):
     try:
         faculty_id = user.get('user_id')
-        preferences = data.get('preferences', [])
-        
-        valid_days = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
-        
-        await db.faculty_preferences.delete_many({'faculty_id': faculty_id})
+        preferences = data.preferences
         
+        preference_docs = []
         if preferences:
-            preference_docs = []
+            faculty_doc = await db.users.find_one({'_id': ObjectId(faculty_id)}, {'assigned_courses': 1})
+            assigned_courses = set(faculty_doc.get('assigned_courses', []))
+            course_object_ids = list(set(parse_course_ids([pref.course_id for pref in preferences])))
+            courses = await db.courses.find(
+                {'_id': {'$in': course_object_ids}}, {'name': 1, 'code': 1}
+            ).to_list(len(course_object_ids))
+            courses_by_id = {str(course['_id']): course for course in courses}
+            
+            created_at = datetime.now(timezone.utc).isoformat()
             for pref in preferences:
-                if 'course_id' not in pref or 'day' not in pref or 'start_time' not in pref:
-                    raise HTTPException(status_code=400, detail='Invalid preference format')
-                
-                if pref['day'] not in valid_days:
-                    raise HTTPException(status_code=400, detail=f"Invalid day: {pref['day']}")
+                if pref.day not in VALID_DAYS:
+                    raise HTTPException(status_code=400, detail=f"Invalid day: {pref.day}")
                 
-                course = await db.courses.find_one({'_id': ObjectId(pref['course_id'])})
+                course = courses_by_id.get(pref.course_id)
                 if not course:
-                    raise HTTPException(status_code=400, detail=f"Course not found: {pref['course_id']}")
+                    raise HTTPException(status_code=400, detail=f"Course not found: {pref.course_id}")
                 
-                faculty_doc = await db.users.find_one({'_id': ObjectId(faculty_id)})
-                assigned_courses = faculty_doc.get('assigned_courses', [])
-                
-                if pref['course_id'] not in assigned_courses:
+                if pref.course_id not in assigned_courses:
                     raise HTTPException(status_code=403, detail=f"You are not assigned to course: {course['code']}")
                 
                 preference_docs.append({
                     'faculty_id': faculty_id,
-                    'course_id': pref['course_id'],
+                    'course_id': pref.course_id,
                     'course_name': course.get('name', ''),
                     'course_code': course.get('code', ''),
-                    'day': pref['day'],
-                    'start_time': pref['start_time'],
-                    'end_time': pref.get('end_time', ''),
-                    'created_at': datetime.now(timezone.utc).isoformat()
+                    'day': pref.day,
+                    'start_time': pref.start_time,
+                    'end_time': pref.end_time,
+                    'created_at': created_at
                 })
-            
+        
+        await db.faculty_preferences.delete_many({'faculty_id': faculty_id})
+        
+        if preference_docs:
             await db.faculty_preferences.insert_many(preference_docs)
         
         return {'message': 'Timetable preferences updated successfully'}
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Update faculty timetable preferences error: {str(e)}")
+        logger.error("Update faculty timetable preferences error: %s", e)
         raise HTTPException(status_code=500, detail='Failed to update timetable preferences')
 
 @app.get('/api/v1/faculty/timetable-preferences')
@@ -1750,11 +2087,11 @@ async def get_faculty_timetable_preferences(
             pref['_id'] = str(pref['_id'])
             pref['course_id'] = str(pref['course_id'])
         
-        return preferences
+        return ORJSONResponse(preferences)
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Get faculty timetable preferences error: {str(e)}")
+        logger.error("Get faculty timetable preferences error: %s", e)
         raise HTTPException(status_code=500, detail='Failed to fetch timetable preferences')
 
 @app.put('/api/v1/admin/profile')
@@ -1783,11 +2120,15 @@ async def update_admin_profile(
         if data.department is not None:
             update_data['department'] = data.department
         
+        updated_user = user_doc
         if update_data:
             update_data['updated_at'] = datetime.now(timezone.utc).isoformat()
-            await db.users.update_one({'_id': ObjectId(user_id)}, {'$set': update_data})
-        
-        updated_user = await db.users.find_one({'_id': ObjectId(user_id)}, {'password_hash': 0})
+            updated_user = await db.users.find_one_and_update(
+                {'_id': ObjectId(user_id)},
+                {'$set': update_data},
+                projection={'password_hash': 0},
+                return_document=ReturnDocument.AFTER
+            )
         
         return {
             'id': str(updated_user['_id']),
@@ -1801,7 +2142,7 @@ async def update_admin_profile(
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Update admin profile error: {str(e)}")
+        logger.error("Update admin profile error: %s", e)
         raise HTTPException(status_code=500, detail='Failed to update profile')
 
 @app.get('/api/v1/faculty/profile')
@@ -1830,7 +2171,7 @@ async def get_faculty_profile(
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Get faculty profile error: {str(e)}")
+        logger.error("Get faculty profile error: %s", e)
         raise HTTPException(status_code=500, detail='Failed to fetch profile')
 
 @app.put('/api/v1/faculty/profile')
@@ -1863,11 +2204,15 @@ async def update_faculty_profile(
         if data.minTeachingHours is not None:
             update_data['min_teaching_hours'] = data.minTeachingHours
         
+        updated_user = user_doc
         if update_data:
             update_data['updated_at'] = datetime.now(timezone.utc).isoformat()
-            await db.users.update_one({'_id': ObjectId(user_id)}, {'$set': update_data})
-        
-        updated_user = await db.users.find_one({'_id': ObjectId(user_id)}, {'password_hash': 0})
+            updated_user = await db.users.find_one_and_update(
+                {'_id': ObjectId(user_id)},
+                {'$set': update_data},
+                projection={'password_hash': 0},
+                return_document=ReturnDocument.AFTER
+            )
         
         return {
             'id': str(updated_user['_id']),
@@ -1883,7 +2228,7 @@ async def update_faculty_profile(
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Update faculty profile error: {str(e)}")
+        logger.error("Update faculty profile error: %s", e)
         raise HTTPException(status_code=500, detail='Failed to update profile')
 
 @app.get('/api/v1/student/profile')
@@ -1913,7 +2258,7 @@ async def get_student_profile(
                     for course in courses
                 ]
             except Exception as e:
-                logger.error(f"Error fetching enrolled courses: {str(e)}")
+                logger.error("Error fetching enrolled courses: %s", e)
                 enrolled_courses = []
         
         profile = {
@@ -1930,58 +2275,58 @@ async def get_student_profile(
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Get student profile error: {str(e)}")
+        logger.error("Get student profile error: %s", e)
         raise HTTPException(status_code=500, detail='Failed to fetch profile')
 
 @app.post('/api/v1/student/register-courses')
 async def register_courses(
-    request: Request,
+    data: RegisterCoursesRequest,
     user: dict = Depends(require_role(['student']))
 ):
     try:
         student_id = user.get('user_id')
-        req_body = await request.json()
-        course_registrations = req_body.get('courses', [])
+        course_registrations = data.courses
         
         if not course_registrations:
             raise HTTPException(status_code=400, detail='No course registrations provided')
         
+        course_object_ids = list(set(parse_course_ids([registration.course_id for registration in course_registrations])))
+        courses = await db.courses.find(
+            {'_id': {'$in': course_object_ids}}, {'name': 1, 'code': 1, 'faculty_id': 1}
+        ).to_list(len(course_object_ids))
+        courses_by_id = {str(course['_id']): course for course in courses}
+        
+        created_at = datetime.now(timezone.utc).isoformat()
+        preference_docs = []
         for registration in course_registrations:
-            if 'course_id' not in registration:
-                raise HTTPException(status_code=400, detail='Each registration must include a course_id')
-            
-            course = await db.courses.find_one({'_id': ObjectId(registration['course_id'])})
+            course = courses_by_id.get(registration.course_id)
             if not course:
-                raise HTTPException(status_code=404, detail=f"Course not found: {registration['course_id']}")
+                raise HTTPException(status_code=404, detail=f"Course not found: {registration.course_id}")
             
             if not course.get('faculty_id'):
                 raise HTTPException(status_code=400, detail=f"Course {course['name']} has no faculty assigned")
+            
+            preference_docs.append({
+                'student_id': student_id,
+                'course_id': registration.course_id,
+                'course_name': course.get('name', ''),
+                'course_code': course.get('code', ''),
+                'preferred_time': registration.preferred_time,
+                'preferred_professor': registration.preferred_professor,
+                'priority': registration.priority,
+                'created_at': created_at
+            })
         
         await db.student_course_preferences.delete_many({'student_id': student_id})
         
-        if course_registrations:
-            preference_docs = []
-            for registration in course_registrations:
-                course = await db.courses.find_one({'_id': ObjectId(registration['course_id'])})
-                
-                preference_docs.append({
-                    'student_id': student_id,
-                    'course_id': registration['course_id'],
-                    'course_name': course.get('name', ''),
-                    'course_code': course.get('code', ''),
-                    'preferred_time': registration.get('preferred_time', ''),
-                    'preferred_professor': registration.get('preferred_professor', ''),
-                    'priority': registration.get('priority', 1),
-                    'created_at': datetime.now(timezone.utc).isoformat()
-                })
-            
+        if preference_docs:
             await db.student_course_preferences.insert_many(preference_docs)
         
         return {'message': 'Course preferences registered successfully'}
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Register courses error: {str(e)}")
+        logger.error("Register courses error: %s", e)
         raise HTTPException(status_code=500, detail='Failed to register course preferences')
 
 @app.get('/api/v1/student/course-preferences')
@@ -1998,11 +2343,11 @@ async def get_student_course_preferences(
             pref['_id'] = str(pref['_id'])
             pref['course_id'] = str(pref['course_id'])
         
-        return preferences
+        return ORJSONResponse(preferences)
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Get student course preferences error: {str(e)}")
+        logger.error("Get student course preferences error: %s", e)
         raise HTTPException(status_code=500, detail='Failed to fetch course preferences')
 
 @app.get('/api/v1/courses/{course_id}/faculty')
@@ -2032,7 +2377,7 @@ async def get_course_faculty(
         if not faculty_preferences:
             return []
         
-        faculty_ids = list(set([ObjectId(pref['faculty_id']) for pref in faculty_preferences]))
+        faculty_ids = list({ObjectId(pref['faculty_id']) for pref in faculty_preferences})
         faculty = await db.users.find({'_id': {'$in': faculty_ids}}, {'password_hash': 0}).to_list(1000)
         for fac in faculty:
             fac['_id'] = str(fac['_id'])
@@ -2041,83 +2386,77 @@ async def get_course_faculty(
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Get course faculty error: {str(e)}")
+        logger.error("Get course faculty error: %s", e)
         raise HTTPException(status_code=500, detail='Failed to fetch course faculty')
 
 @app.post('/api/v1/timetable/generate-student')
 async def generate_student_timetable(
-    request: Request,
+    data: StudentTimetableRequest,
     background_tasks: BackgroundTasks,
-    user: dict = Depends(require_role(['student']))
+    user: dict = Depends(require_role(['student'])),
+    refresh: bool = Query(False, description=REFRESH_QUERY_DESCRIPTION)
 ):
     try:
         if not OPENROUTER_API_KEY:
             raise HTTPException(status_code=500, detail='AI generation service is not configured')
 
-        req_body = await request.json()
-        selected_course_ids = req_body.get('courseIds', [])
+        selected_course_ids = sorted(set(data.courseIds))
         
         if not selected_course_ids:
             raise HTTPException(status_code=400, detail='No course IDs provided')
 
-        selected_course_object_ids = [ObjectId(cid) for cid in selected_course_ids]
-        selected_courses_cursor = db.courses.find({'_id': {'$in': selected_course_object_ids}})
+        selected_course_object_ids = parse_course_ids(selected_course_ids)
+        selected_courses_cursor = db.courses.find({'_id': {'$in': selected_course_object_ids}}).sort('_id', 1)
         selected_courses = await selected_courses_cursor.to_list(length=None)
         
         if not selected_courses:
             raise HTTPException(status_code=404, detail='Selected courses not found')
-        all_faculty = await db.users.find({'role': 'faculty'}, {'password_hash': 0}).to_list(length=None)
-        all_rooms = await db.rooms.find({}).to_list(length=None)
-        base_timetable = await db.base_timetables.find_one(sort=[('created_at', -1)])
+        all_faculty = await db.users.find({'role': 'faculty'}, {'name': 1, 'email': 1}).to_list(length=None)
+        all_rooms = await db.rooms.find({}, {'name': 1, 'capacity': 1, 'type': 1}).to_list(length=None)
+        base_timetable = await get_cached_setting('base_timetable', load_base_timetable)
         
         student_id = user.get('user_id')
         student_preferences = await db.student_course_preferences.find({'student_id': student_id}).to_list(1000)
-        
-        existing_timetables = await db.timetables.find({
-            'student_id': {'$ne': None}
-        }).to_list(1000)
-        
-        existing_course_schedules = {}
-        for timetable in existing_timetables:
-            for slot in timetable.get('schedule', []):
-                course_id = slot.get('course_id')
-                if course_id:
-                    if course_id not in existing_course_schedules:
-                        existing_course_schedules[course_id] = []
-                    existing_course_schedules[course_id].append({
-                        'day': slot.get('day'),
-                        'time': slot.get('time'),
-                        'room_id': slot.get('room_id'),
-                        'room_name': slot.get('room_name'),
-                        'room_capacity': 0
-                    })
-        
-        for course_id, schedules in existing_course_schedules.items():
-            for schedule in schedules:
-                room = await db.rooms.find_one({'_id': ObjectId(schedule['room_id'])})
-                if room:
-                    schedule['room_capacity'] = room.get('capacity', 0)
-                    schedule['current_students'] = await db.timetables.count_documents({
-                        'schedule': {
-                            '$elemMatch': {
-                                'course_id': course_id,
-                                'room_id': schedule['room_id'],
-                                'day': schedule['day'],
-                                'time': schedule['time']
-                            }
-                        }
-                    })
-
-        working_days = base_timetable.get('days', ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday'])
+        student_prefs_by_course = {pref['course_id']: pref for pref in reversed(student_preferences)}
+        
+        slot_occupancy, existing_slots = await get_schedule_usage(selected_course_ids)
+        
+        rooms_by_id = {str(room['_id']): room for room in all_rooms}
+        existing_course_schedules = defaultdict(list)
+        for slot in existing_slots:
+            course_id = slot['course_id']
+            schedule = {
+                'day': slot.get('day'),
+                'time': slot.get('time'),
+                'room_id': slot.get('room_id'),
+                'room_name': slot.get('room_name'),
+                'room_capacity': 0
+            }
+            room = rooms_by_id.get(schedule['room_id'])
+            if room:
+                schedule['room_capacity'] = room.get('capacity', 0)
+                schedule['current_students'] = slot_occupancy.get(
+                    (course_id, schedule['room_id'], schedule['day'], schedule['time']), 0
+                )
+            existing_course_schedules[course_id].append(schedule)
+
+        working_days = base_timetable.get('days', DEFAULT_WORKING_DAYS) if base_timetable else DEFAULT_WORKING_DAYS
         num_working_days = len(working_days)
+        available_room_types = {room.get('type') for room in all_rooms}
 
         courses_data_for_ai = []
         unassigned_courses = []
         
+        unassigned_course_ids = [str(course['_id']) for course in selected_courses if not course.get('faculty_id')]
+        courses_with_faculty_prefs = set()
+        if unassigned_course_ids:
+            courses_with_faculty_prefs = set(await db.faculty_preferences.distinct(
+                'course_id', {'course_id': {'$in': unassigned_course_ids}}
+            ))
+        
         for course in selected_courses:
             if not course.get('faculty_id'):
-                faculty_prefs = await db.faculty_preferences.find({'course_id': str(course['_id'])}).to_list(1000)
-                if not faculty_prefs:
+                if str(course['_id']) not in courses_with_faculty_prefs:
                     unassigned_courses.append({
                         'name': course['name'],
                         'code': course['code'],
@@ -2128,6 +2467,14 @@ async def generate_student_timetable(
             is_lab = course.get('is_lab', False)
             credits = course.get('credits', 1)
             
+            if not available_room_types & (LAB_ROOM_TYPES if is_lab else THEORY_ROOM_TYPES):
+                unassigned_courses.append({
+                    'name': course['name'],
+                    'code': course['code'],
+                    'reason': 'No compatible room available for this course'
+                })
+                continue
+            
             if is_lab:
                 classes_per_week = 1
             else:
@@ -2146,7 +2493,7 @@ async def generate_student_timetable(
                 'no_same_day': True
             }
             
-            student_pref = next((pref for pref in student_preferences if pref['course_id'] == str(course['_id'])), None)
+            student_pref = student_prefs_by_course.get(str(course['_id']))
             if student_pref:
                 course_info['preferred_time'] = student_pref.get('preferred_time', '')
                 course_info['preferred_professor'] = student_pref.get('preferred_professor', '')
@@ -2160,7 +2507,7 @@ async def generate_student_timetable(
         if len(courses_data_for_ai) == 0:
             return {
                 'schedule': [],
-                'summary': 'None of the selected courses have faculty assigned. Please select different courses or contact the administrator.',
+                'summary': 'None of the selected courses can be scheduled. Please select different courses or contact the administrator.',
                 'unassigned_courses': unassigned_courses
             }
 
@@ -2172,8 +2519,14 @@ async def generate_student_timetable(
                 'email': fac['email']
             })
 
+        needed_room_types = set()
+        for course_info in courses_data_for_ai:
+            needed_room_types |= LAB_ROOM_TYPES if course_info['is_lab'] else THEORY_ROOM_TYPES
+
         rooms_data_for_ai = []
         for room in all_rooms:
+            if room['type'] not in needed_room_types:
+                continue
             rooms_data_for_ai.append({
                 'id': str(room['_id']),
                 'name': room['name'],
@@ -2181,19 +2534,19 @@ async def generate_student_timetable(
                 'type': room['type']
             })
 
-        base_timetable_json = json.dumps(base_timetable, default=str, indent=2) if base_timetable else "{}"
+        base_timetable_json = await get_cached_setting('base_timetable_json', load_base_timetable_json)
         
         prompt = f"""
 You are a university timetable scheduling expert. Generate a personalized weekly timetable for a single student following NEP 2020 guidelines.
 
 STUDENT'S SELECTED COURSES:
-{json.dumps(courses_data_for_ai, indent=2)}
+{prompt_json(courses_data_for_ai)}
 
 ALL AVAILABLE FACULTY:
-{json.dumps(faculty_data_for_ai, indent=2)}
+{prompt_json(faculty_data_for_ai)}
 
 ALL AVAILABLE ROOMS:
-{json.dumps(rooms_data_for_ai, indent=2)}
+{prompt_json(rooms_data_for_ai)}
 
 BASE TIMETABLE STRUCTURE:
 {base_timetable_json}
@@ -2264,65 +2617,32 @@ If a course has no assigned faculty, include a note in the summary.
 Do not use markdown formatting. Return only the raw JSON object.
 """
 
-        try:
-            response = requests.post(
-                url="https://openrouter.ai/api/v1/chat/completions",
-                headers={
-                    "Authorization": f"Bearer {OPENROUTER_API_KEY}",
-                    "Content-Type": "application/json",
-                },
-                data=json.dumps({
-                    "model": OPENROUTER_MODEL,
-                    "messages": [
-                        {
-                            "role": "user",
-                            "content": prompt
-                        }
-                    ]
-                }),
-                timeout=None
-            )
-
-            if response.status_code != 200:
-                logger.error(f"OpenRouter API error: {response.status_code} - {response.text}")
-                raise HTTPException(status_code=500, detail='Failed to generate timetable')
-
-            try:
-                response_text = response.json()['choices'][0]['message']['content']
-                if response_text.startswith('```json'):
-                    response_text = response_text[7:]
-                if response_text.startswith('```'):
-                    response_text = response_text[3:]
-                if response_text.endswith('```'):
-                    response_text = response_text[:-3]
-                
-                timetable_data = json.loads(response_text.strip())
-            except (json.JSONDecodeError, KeyError) as e:
-                logger.error(f"JSON decode error: {str(e)}")
-                logger.error(f"AI Response: {response_text}")
-                raise HTTPException(status_code=500, detail='Failed to parse AI response')
-            timetable_record = {
-                'schedule': timetable_data.get('schedule', []),
-                'summary': timetable_data.get('summary', 'AI-generated timetable'),
-                'generated_at': datetime.now(timezone.utc).isoformat(),
-                'generated_by': user.get('user_id'),
-                'student_id': user.get('user_id'),
-                'unassigned_courses': unassigned_courses
-            }
-            
-            result = await db.timetables.insert_one(timetable_record)
-            timetable_record['_id'] = str(result.inserted_id)
+        prompt_hash, timetable_data, from_cache = await request_ai_timetable(prompt, refresh)
+        if from_cache:
+            existing_timetable = await find_generated_timetable(prompt_hash, {'student_id': user.get('user_id')})
+            if existing_timetable:
+                return existing_timetable
+        
+        timetable_record = {
+            'schedule': timetable_data.get('schedule', []),
+            'summary': timetable_data.get('summary', 'AI-generated timetable'),
+            'generated_at': datetime.now(timezone.utc).isoformat(),
+            'generated_by': user.get('user_id'),
+            'student_id': user.get('user_id'),
+            'unassigned_courses': unassigned_courses,
+            'prompt_hash': prompt_hash
+        }
 
-            return timetable_record
+        result = await db.timetables.insert_one(timetable_record)
+        invalidate_schedule_usage()
+        timetable_record['_id'] = str(result.inserted_id)
 
-        except requests.exceptions.RequestException as e:
-            logger.error(f"Request to OpenRouter failed: {str(e)}")
-            raise HTTPException(status_code=500, detail='Failed to connect to AI service')
+        return timetable_record
         
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Generate student timetable error: {str(e)}")
+        logger.error("Generate student timetable error: %s", e)
         raise HTTPException(status_code=500, detail=f'Failed to generate timetable: {str(e)}')
 
 @app.put('/api/v1/student/profile')
@@ -2351,11 +2671,15 @@ async def update_student_profile(
         if data.enrollmentYear is not None:
             update_data['enrollment_year'] = data.enrollmentYear
         
+        updated_user = user_doc
         if update_data:
             update_data['updated_at'] = datetime.now(timezone.utc).isoformat()
-            await db.users.update_one({'_id': ObjectId(user_id)}, {'$set': update_data})
-        
-        updated_user = await db.users.find_one({'_id': ObjectId(user_id)}, {'password_hash': 0})
+            updated_user = await db.users.find_one_and_update(
+                {'_id': ObjectId(user_id)},
+                {'$set': update_data},
+                projection={'password_hash': 0},
+                return_document=ReturnDocument.AFTER
+            )
         
         enrolled_courses = []
         course_ids = updated_user.get('enrolled_courses', [])
@@ -2372,7 +2696,7 @@ async def update_student_profile(
                     for course in courses
                 ]
             except Exception as e:
-                logger.error(f"Error fetching enrolled courses: {str(e)}")
+                logger.error("Error fetching enrolled courses: %s", e)
                 enrolled_courses = []
         
         return {
@@ -2388,7 +2712,7 @@ async def update_student_profile(
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Update student profile error: {str(e)}")
+        logger.error("Update student profile error: %s", e)
         raise HTTPException(status_code=500, detail='Failed to update profile')
 
 @app.get('/api/v1/health')
@@ -2408,9 +2732,8 @@ def custom_openapi():
     return app.openapi_schema
 
 if __name__ == '__main__':
-    import uvicorn
     uvicorn.run(
-        app,
+        "server:app",
         host="0.0.0.0",
         port=8000,
         reload=IS_DEVELOPMENT,